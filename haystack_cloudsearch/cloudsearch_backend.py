@@ -16,6 +16,8 @@ from haystack.utils import get_identifier
 from haystack_cloudsearch.cloudsearch_utils import (ID, DJANGO_CT, DJANGO_ID,
                                                     gen_version,
                                                     botobool)
+from haystack_cloudsearch.querylog import shared_query_log
+from haystack_cloudsearch.singleflight import freeze, shared_single_flight
 try:
     import boto
 except ImportError:
@@ -23,6 +25,7 @@ except ImportError:
 
 try:
     from boto.cloudsearch import CloudsearchProcessingException, CloudsearchNeedsIndexingException
+    from boto.cloudsearch.search import SearchConnection
 except ImportError:
     raise MissingDependency("The 'cloudsearch' backend requires an installation of 'boto' from the cloudsearch branch at https://github.com/pbs/boto")
 
@@ -65,6 +68,21 @@ class CloudsearchSearchBackend(BaseSearchBackend):
 
         self.prepare_silently = connection_options.get('PREPARE_SILENTLY', False)
 
+        # Concurrent identical searches share a single request to Cloudsearch across every
+        # backend for this connection; waiters give up on a stalled request after
+        # COALESCE_TIMEOUT seconds and make their own
+        self.coalesce_searches = connection_options.get('COALESCE_SEARCHES', True)
+        self.search_flight = shared_single_flight(connection_alias, connection_options.get('COALESCE_TIMEOUT', 1))
+
+        # Optionally record a sample of searches for replay with haystack_cloudsearch.replay
+        query_log_path = connection_options.get('QUERY_LOG')
+        self.query_log = None
+        if query_log_path is not None:
+            self.query_log = shared_query_log(query_log_path, connection_options.get('QUERY_LOG_SAMPLE_RATE', 0.01))
+
+        # Send searches to this endpoint instead of the SearchDomain's, e.g. a local stand-in service
+        self.search_endpoint = connection_options.get('SEARCH_ENDPOINT')
+
         self.ip_address = connection_options.get('IP_ADDRESS')
         if self.ip_address is None:
             raise ImproperlyConfigured("You must specify IP_ADDRESS in your settings for connection '%s'." % connection_alias)
@@ -433,6 +451,7 @@ class CloudsearchSearchBackend(BaseSearchBackend):
             unified_index = conn.get_unified_index()
             indexes = unified_index.collect_indexes()
 
+        t0 = time.time()
         results = []
         for index in indexes:
             results.append(self._process_results(self.search_index(index, query_string, **kwargs)))
@@ -447,6 +466,10 @@ class CloudsearchSearchBackend(BaseSearchBackend):
             # this will mangle some results if you have facets from two search domains with the same index field name...
             facets.update(r['facets'])
 
+        if self.query_log is not None and self.query_log.sampled():
+            self.query_log.record('search', [self.get_searchdomain_name(i) for i in indexes],
+                                  query_string, kwargs, time.time() - t0, total_hits)
+
         return {
             'results': total_results,
             'hits': total_hits,
@@ -471,13 +494,54 @@ class CloudsearchSearchBackend(BaseSearchBackend):
             return_fields = list(set(return_fields))
         except KeyError:
             return_fields = self.field_names_for_index(index)
+        search_domain_name = self.get_searchdomain_name(index)
+
+        if self.query_log is None or not self.query_log.sampled():
+            return self.search_domain(search_domain_name, query_string, return_fields, **kwargs)
+
+        logged_kwargs = dict(kwargs, return_fields=return_fields)
+        t0 = time.time()
         try:
-            search_service = self.get_domain(index).get_search_service(loose=False, needs_integrity=True)
-        except (CloudsearchProcessingException, CloudsearchNeedsIndexingException):
-            raise  # We should probably wrap this into something more common to haystack
-        query = search_service.search(bq=query_string, return_fields=return_fields, **kwargs)
+            query = self.search_domain(search_domain_name, query_string, return_fields, **kwargs)
+        except Exception, e:
+            self.query_log.record('search_index', search_domain_name, query_string, logged_kwargs,
+                                  time.time() - t0, None, error=e.__class__.__name__)
+            raise
+        self.query_log.record('search_index', search_domain_name, query_string, logged_kwargs,
+                              time.time() - t0, query.hits)
         return query
 
+    def search_domain(self, search_domain_name, query_string, return_fields, **kwargs):
+        """ given a SearchDomain name, a boolean query, and the fields to return, return raw boto results
+
+            Identical searches against the same SearchDomain that are already in flight
+            share that request and its decoded results unless COALESCE_SEARCHES is False.
+            If SEARCH_ENDPOINT is set, the search is sent there instead of to the SearchDomain.
+
+        :raises: boto.cloudsearch.CloudsearchProcessingException, boto.cloudsearch.CloudsearchNeedsIndexingException
+        """
+        def run():
+            if self.search_endpoint is not None:
+                search_service = SearchConnection(endpoint=self.search_endpoint)
+            else:
+                try:
+                    search_service = self.boto_conn.get_domain(search_domain_name).get_search_service(loose=False, needs_integrity=True)
+                except (CloudsearchProcessingException, CloudsearchNeedsIndexingException):
+                    raise  # We should probably wrap this into something more common to haystack
+            return search_service.search(bq=query_string, return_fields=return_fields, **kwargs)
+
+        if not self.coalesce_searches:
+            return run()
+        key = (search_domain_name, query_string, tuple(sorted(return_fields)), freeze(kwargs))
+        return self.search_flight.do(key, run)
+
+    def coalesce_stats(self):
+        """ returns a dict counting searches that went to Cloudsearch (leaders), searches that shared
+            an in-flight request (coalesced), and waiters that gave up and searched on their own (timeouts)
+        """
+        with self.search_flight.lock:
+            return dict(self.search_flight.stats)
+
     def _process_results(self, boto_results, result_class=None):
         """ return a dict compatible with SearchQuerySet when given raw boto results
             cloudsearch doesn't really provide a scoring mechanism, so we use reverse
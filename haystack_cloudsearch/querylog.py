@@ -0,0 +1,106 @@
+
+import json
+import logging
+import random
+import threading
+import time
+
+
+def jsonable(obj):
+    """ convert sets and tuples in obj to lists so they survive a round trip through json """
+    if isinstance(obj, dict):
+        return dict((k, jsonable(v)) for k, v in obj.iteritems())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return [jsonable(x) for x in obj]
+    return obj
+
+
+class QueryLog(object):
+    """ appends a sampled record of searches to a file, one compact json object per line
+
+        Each record has the operation (search or search_index), the SearchDomain name(s),
+        the boolean query, the search kwargs, latency in seconds, the hit count, and the
+        exception class name if the search failed. Failures to write are logged rather
+        than raised, so the log can't break the searches it records.
+    """
+
+    def __init__(self, path, sample_rate=0.01):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.lock = threading.Lock()
+        self.log = logging.getLogger('haystack-cloudsearch')
+        try:
+            self.file = open(path, 'a', 1)  # line buffered
+        except (IOError, OSError):
+            self.log.exception(u'Unable to open query log %s; searches will not be recorded' % (path,))
+            self.file = None
+
+    def sampled(self):
+        """ decide whether the next search should be recorded """
+        if self.file is None:
+            return False
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def record(self, op, domain, bq, kwargs, latency, hits, error=None):
+        if self.file is None:
+            return
+        entry = {'ts': time.time(), 'op': op, 'domain': domain, 'bq': bq,
+                 'kwargs': jsonable(kwargs), 'latency': round(latency, 6), 'hits': hits}
+        if error is not None:
+            entry['error'] = error
+        try:
+            line = json.dumps(entry, separators=(',', ':'))
+        except (TypeError, ValueError):
+            self.log.exception(u'Unable to encode %s on %s for the query log' % (op, domain))
+            return
+        try:
+            with self.lock:
+                self.file.write(line + '\n')
+        except (IOError, OSError):
+            self.log.exception(u'Unable to write to query log %s' % (self.path,))
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_query_log(path, sample_rate=0.01):
+    """ return the QueryLog writing to path, creating it if needed
+
+        Haystack gives each thread its own backend, so backends share one QueryLog
+        per path, and with it one file handle and lock. The sample rate of the first
+        caller for a path wins.
+    """
+    with _shared_lock:
+        try:
+            return _shared[path]
+        except KeyError:
+            log = _shared[path] = QueryLog(path, sample_rate)
+            return log
+
+
+def read_query_log(path, op=None, skipped=None):
+    """ yield the records written by a QueryLog, optionally only those for op
+
+        Lines that aren't valid json, such as a partial last line left by a process that
+        was killed mid-write, are skipped; if skipped is a list, their line numbers are
+        appended to it.
+    """
+    with open(path) as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                if skipped is not None:
+                    skipped.append(n)
+                continue
+            if op is None or (isinstance(entry, dict) and entry.get('op') == op):
+                yield entry
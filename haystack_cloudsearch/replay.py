@@ -0,0 +1,160 @@
+""" Replay a query log written by a backend with QUERY_LOG set.
+
+Only search_index records are replayed; search records summarize the same requests
+across SearchDomains. Run it with your Django settings available, e.g.::
+
+    DJANGO_SETTINGS_MODULE=myproject.settings python -m haystack_cloudsearch.replay \\
+        --concurrency 8 --endpoint localhost:8080 queries.log
+"""
+
+import math
+import optparse
+import Queue
+import threading
+import time
+
+from haystack_cloudsearch.querylog import read_query_log
+
+
+def percentile(sorted_values, pct):
+    """ nearest-rank percentile of an already sorted list """
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(sorted_values))) - 1
+    return sorted_values[max(rank, 0)]
+
+
+def replay(backend, entries, rate=None, concurrency=1):
+    """ run search_index records from a query log against backend
+
+        rate - target requests per second (default: as fast as concurrency allows)
+        concurrency - number of threads issuing searches
+
+        With a rate, latency is measured from each request's scheduled send time, so time
+        spent queued behind a backend that can't keep up counts against it. Latency
+        percentiles cover successful requests only, so fast failures can't flatter them.
+
+        returns a dict with requests, errors, elapsed, target rate, throughput, latency
+        percentiles, and per-domain request and error counts, with errors broken down by
+        exception class; records that can't be replayed count as errors for their domain
+    """
+    jobs = Queue.Queue(maxsize=concurrency * 2)
+    lock = threading.Lock()
+    latencies = []
+    domains = {}
+
+    def work():
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            scheduled, entry = job
+            t0 = time.time() if scheduled is None else scheduled
+            domain = entry.get('domain') if isinstance(entry, dict) else None
+            error = None
+            try:
+                kwargs = dict((str(k), v) for k, v in entry['kwargs'].items())
+                return_fields = kwargs.pop('return_fields')
+                backend.search_domain(domain, entry['bq'], return_fields, **kwargs)
+            except Exception, e:
+                error = e.__class__.__name__
+            latency = time.time() - t0
+            with lock:
+                stats = domains.setdefault(domain, {'requests': 0, 'errors': 0, 'errors_by_type': {}})
+                stats['requests'] += 1
+                if error is None:
+                    latencies.append(latency)
+                else:
+                    stats['errors'] += 1
+                    stats['errors_by_type'][error] = stats['errors_by_type'].get(error, 0) + 1
+
+    threads = [threading.Thread(target=work) for _ in range(concurrency)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    started = time.time()
+    for n, entry in enumerate(entries):
+        scheduled = None
+        if rate:
+            scheduled = started + n / float(rate)
+            delay = scheduled - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        jobs.put((scheduled, entry))
+    for _ in threads:
+        jobs.put(None)
+    for t in threads:
+        t.join()
+    elapsed = time.time() - started
+
+    latencies.sort()
+    for stats in domains.values():
+        stats['error_rate'] = stats['errors'] / float(stats['requests'])
+    requests = sum(stats['requests'] for stats in domains.values())
+    return {
+        'requests': requests,
+        'errors': requests - len(latencies),
+        'elapsed': elapsed,
+        'rate': rate,
+        'throughput': requests / elapsed if elapsed else 0.0,
+        'latency': dict(('p%d' % p, percentile(latencies, p)) for p in (50, 90, 99)),
+        'max_latency': latencies[-1] if latencies else None,
+        'domains': domains,
+    }
+
+
+def format_report(report):
+    """ render the dict returned by replay() as text """
+    def ms(seconds):
+        return '-' if seconds is None else '%.1fms' % (seconds * 1000,)
+
+    target = '' if not report['rate'] else ', target %.1f/s' % (report['rate'],)
+    lines = ['requests:   %d in %.2fs (%.1f/s%s), %d errors' % (report['requests'], report['elapsed'],
+                                                           report['throughput'], target, report['errors']),
+             'latency:    p50 %s  p90 %s  p99 %s  max %s (successful requests)' % (
+                 ms(report['latency']['p50']), ms(report['latency']['p90']),
+                 ms(report['latency']['p99']), ms(report['max_latency']))]
+    for name, stats in sorted(report['domains'].items()):
+        line = '%s: %d requests, %d errors (%.2f%%)' % (name, stats['requests'], stats['errors'], stats['error_rate'] * 100)
+        if stats['errors_by_type']:
+            line += ': ' + ', '.join('%s %d' % x for x in sorted(stats['errors_by_type'].items()))
+        lines.append(line)
+    if report.get('skipped'):
+        lines.append('skipped:    %d undecodable query log lines' % (report['skipped'],))
+    if 'coalesce' in report:
+        lines.append('coalesce:   %(leaders)d leaders, %(coalesced)d coalesced, %(timeouts)d timeouts' % report['coalesce'])
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage='%prog [options] QUERY_LOG')
+    parser.add_option('--using', default='default', help='haystack connection alias to replay against')
+    parser.add_option('--rate', type='float', help='target requests per second (default: unthrottled)')
+    parser.add_option('--concurrency', type='int', default=1, help='number of concurrent searches')
+    parser.add_option('--endpoint', help='send searches to this host instead of the SearchDomains, e.g. a local stand-in')
+    parser.add_option('--limit', type='int', help='replay at most this many records')
+    options, args = parser.parse_args(argv)
+    if len(args) != 1:
+        parser.error('a single QUERY_LOG is required')
+
+    import haystack
+    backend = haystack.connections[options.using].get_backend()
+    # don't record the replay into a query log of its own
+    backend.query_log = None
+    if options.endpoint:
+        backend.search_endpoint = options.endpoint
+
+    skipped = []
+    entries = list(read_query_log(args[0], op='search_index', skipped=skipped))
+    if options.limit is not None:
+        entries = entries[:options.limit]
+
+    report = replay(backend, entries, rate=options.rate, concurrency=options.concurrency)
+    report['skipped'] = len(skipped)
+    report['coalesce'] = backend.coalesce_stats()
+    print format_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+
+import sys
+import threading
+
+
+def freeze(obj):
+    """ turn nested dicts/lists/sets into a hashable, order-independent equivalent """
+    if isinstance(obj, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in obj.iteritems()))
+    if isinstance(obj, (set, frozenset)):
+        return tuple(sorted(freeze(x) for x in obj))
+    if isinstance(obj, (list, tuple)):
+        return tuple(freeze(x) for x in obj)
+    return obj
+
+
+class _Flight(object):
+    """ a single in-flight call; holds the result or exc_info once finished """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """ coalesces concurrent calls sharing a key into a single call
+
+        The first caller for a key (the leader) runs the function; callers arriving
+        while it is in flight wait up to `timeout` seconds and receive the same
+        result, or have the same exception re-raised. A waiter never waits longer
+        than `timeout` in total: the first to time out replaces the stalled flight
+        and leads a new one, so later callers wait on it instead, and the rest make
+        their own call. `stats` counts leaders, coalesced waiters, and timeouts.
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.stats = {'leaders': 0, 'coalesced': 0, 'timeouts': 0}
+
+    def do(self, key, fn):
+        """ call fn(), or wait on an identical in-flight call for key """
+        with self.lock:
+            flight, leader = self._join(key)
+
+        if not leader:
+            flight.done.wait(self.timeout)
+            with self.lock:
+                if flight.done.is_set():
+                    self.stats['coalesced'] += 1
+                else:
+                    self.stats['timeouts'] += 1
+                    if self.flights.get(key) is flight:
+                        del self.flights[key]
+                        flight, leader = self._join(key)
+                    else:
+                        # another waiter already replaced the stalled flight; don't wait again
+                        flight = None
+            if flight is None:
+                return fn()
+
+        if leader:
+            return self._lead(key, flight, fn)
+        if flight.exc_info is not None:
+            exc_type, exc_value, tb = flight.exc_info
+            raise exc_type, exc_value, tb
+        return flight.result
+
+    def _join(self, key):
+        """ return (flight, is_leader) for key, registering a new flight if none is in the air;
+            the caller must hold self.lock
+        """
+        flight = self.flights.get(key)
+        if flight is not None:
+            return flight, False
+        flight = self.flights[key] = _Flight()
+        self.stats['leaders'] += 1
+        return flight, True
+
+    def _lead(self, key, flight, fn):
+        try:
+            flight.result = fn()
+        except:
+            flight.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self.lock:
+                # a waiter may already have replaced this flight after timing out
+                if self.flights.get(key) is flight:
+                    del self.flights[key]
+            flight.done.set()
+        return flight.result
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_single_flight(name, timeout=None):
+    """ return the SingleFlight registered for (name, timeout), creating it if needed
+
+        Haystack gives each thread its own backend, so backends share their flights
+        through this registry rather than holding their own.
+    """
+    with _shared_lock:
+        try:
+            return _shared[(name, timeout)]
+        except KeyError:
+            flight = _shared[(name, timeout)] = SingleFlight(timeout=timeout)
+            return flight
@@ -0,0 +1,179 @@
+
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from haystack_cloudsearch.querylog import QueryLog, read_query_log, shared_query_log
+from haystack_cloudsearch.replay import format_report, percentile, replay
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class FullDisk(object):
+
+    def write(self, data):
+        raise IOError(28, 'No space left on device')
+
+
+class QueryLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'queries.log')
+        self.handler = ListHandler()
+        logging.getLogger('haystack-cloudsearch').addHandler(self.handler)
+
+    def tearDown(self):
+        logging.getLogger('haystack-cloudsearch').removeHandler(self.handler)
+        shutil.rmtree(self.dir)
+
+    def test_records_round_trip(self):
+        log = QueryLog(self.path, sample_rate=1)
+        log.record('search_index', 'haystack-note', "(and title:'x')", {'size': 10, 'return_fields': ['id']}, 0.25, 3)
+        log.record('search_index', 'haystack-note', "(and title:'y')", {}, 0.5, None, error='CloudsearchProcessingException')
+        log.record('search', ['haystack-note'], "(and title:'x')", {}, 0.3, 3)
+        log.close()
+
+        entries = list(read_query_log(self.path, op='search_index'))
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[0]['domain'], 'haystack-note')
+        self.assertEqual(entries[0]['bq'], "(and title:'x')")
+        self.assertEqual(entries[0]['kwargs'], {'size': 10, 'return_fields': ['id']})
+        self.assertEqual(entries[0]['latency'], 0.25)
+        self.assertEqual(entries[0]['hits'], 3)
+        self.assertFalse('error' in entries[0])
+        self.assertEqual(entries[1]['error'], 'CloudsearchProcessingException')
+        self.assertEqual(len(list(read_query_log(self.path))), 3)
+
+    def test_sets_and_tuples_are_written_as_lists(self):
+        log = QueryLog(self.path, sample_rate=1)
+        log.record('search_index', 'd', 'q', {'facet': set(['a']), 'return_fields': ('id',)}, 0.1, 1)
+        log.close()
+        entry = list(read_query_log(self.path))[0]
+        self.assertEqual(entry['kwargs'], {'facet': ['a'], 'return_fields': ['id']})
+
+    def test_unencodable_kwargs_are_logged_not_stringified(self):
+        log = QueryLog(self.path, sample_rate=1)
+        log.record('search_index', 'd', 'q', {'size': object()}, 0.1, 1)
+        log.close()
+        self.assertEqual(list(read_query_log(self.path)), [])
+        self.assertEqual(len(self.handler.records), 1)
+
+    def test_unwritable_path_is_logged_not_raised(self):
+        log = QueryLog(os.path.join(self.dir, 'missing', 'queries.log'), sample_rate=1)
+        self.assertFalse(log.sampled())
+        self.assertEqual(len(self.handler.records), 1)
+
+    def test_write_errors_are_logged_not_raised(self):
+        log = QueryLog(self.path, sample_rate=1)
+        log.file.close()
+        log.file = FullDisk()
+        log.record('search_index', 'd', 'q', {}, 0.1, 1)
+        self.assertEqual(len(self.handler.records), 1)
+
+    def test_truncated_last_line_is_skipped(self):
+        log = QueryLog(self.path, sample_rate=1)
+        log.record('search_index', 'd', 'q', {'return_fields': ['id']}, 0.1, 1)
+        log.file.write('{"op":"search_index","domain":"d","bq":"q","kwa')
+        log.close()
+
+        skipped = []
+        entries = list(read_query_log(self.path, op='search_index', skipped=skipped))
+        self.assertEqual([e['domain'] for e in entries], ['d'])
+        self.assertEqual(skipped, [2])
+
+    def test_shared_query_log_is_one_per_path(self):
+        other = os.path.join(self.dir, 'other.log')
+        log = shared_query_log(self.path, sample_rate=1)
+        self.assertTrue(shared_query_log(self.path) is log)
+        self.assertFalse(shared_query_log(other) is log)
+
+    def test_sample_rate(self):
+        self.assertTrue(QueryLog(self.path, sample_rate=1).sampled())
+        self.assertFalse(QueryLog(self.path, sample_rate=0).sampled())
+
+
+class FakeBackend(object):
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+
+    def search_domain(self, search_domain_name, query_string, return_fields, **kwargs):
+        time.sleep(self.delay)
+        self.calls.append((search_domain_name, query_string, return_fields, kwargs))
+        if search_domain_name == 'broken':
+            raise ValueError('broken')
+
+
+class ReplayTest(unittest.TestCase):
+
+    def entry(self, domain='d', **kwargs):
+        kwargs.setdefault('return_fields', ['id'])
+        return {'op': 'search_index', 'domain': domain, 'bq': 'q', 'kwargs': kwargs}
+
+    def test_percentile_is_nearest_rank(self):
+        self.assertEqual(percentile(range(1, 8), 90), 7)
+        self.assertEqual(percentile(range(1, 8), 50), 4)
+        self.assertEqual(percentile(range(1, 101), 99), 99)
+        self.assertEqual(percentile([5], 1), 5)
+        self.assertEqual(percentile([], 50), None)
+
+    def test_replays_entries_and_counts_errors_per_domain(self):
+        backend = FakeBackend()
+        report = replay(backend, [self.entry(size=10), self.entry(), self.entry('broken')], concurrency=2)
+        self.assertEqual(report['requests'], 3)
+        self.assertEqual(report['errors'], 1)
+        self.assertEqual(report['domains']['d'], {'requests': 2, 'errors': 0, 'errors_by_type': {}, 'error_rate': 0.0})
+        self.assertEqual(report['domains']['broken']['error_rate'], 1.0)
+        self.assertEqual(report['domains']['broken']['errors_by_type'], {'ValueError': 1})
+        self.assertTrue('ValueError 1' in format_report(report))
+        self.assertTrue(('d', 'q', ['id'], {'size': 10}) in backend.calls)
+
+    def test_malformed_entries_do_not_hang(self):
+        # no bq or kwargs, no return_fields, and not a record at all
+        entries = [{'op': 'search_index', 'domain': 'd'}, dict(self.entry(), kwargs={}), ['junk']] * 5
+        done = threading.Event()
+        reports = []
+
+        def run():
+            reports.append(replay(FakeBackend(), entries, concurrency=1))
+            done.set()
+
+        t = threading.Thread(target=run)
+        t.daemon = True
+        t.start()
+        done.wait(5)
+        self.assertTrue(done.is_set())
+        self.assertEqual(reports[0]['requests'], 15)
+        self.assertEqual(reports[0]['domains']['d']['errors'], 10)
+        self.assertEqual(reports[0]['domains']['d']['errors_by_type'], {'KeyError': 10})
+        self.assertEqual(reports[0]['domains'][None]['errors_by_type'], {'TypeError': 5})
+
+    def test_latency_percentiles_exclude_failures(self):
+        report = replay(FakeBackend(), [self.entry('broken')] * 5)
+        self.assertEqual(report['errors'], 5)
+        self.assertEqual(report['latency']['p50'], None)
+        self.assertEqual(report['max_latency'], None)
+
+    def test_latency_includes_time_queued_behind_target_rate(self):
+        # one worker at 0.05s per search can't keep up with 100/s, so later requests queue
+        report = replay(FakeBackend(delay=0.05), [self.entry()] * 10, rate=100, concurrency=1)
+        self.assertTrue(report['max_latency'] > 0.3)
+        self.assertTrue('target 100.0/s' in format_report(report))
+
+
+if __name__ == '__main__':
+    unittest.main()
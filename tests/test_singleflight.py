@@ -0,0 +1,178 @@
+
+import threading
+import time
+import unittest
+
+from haystack_cloudsearch.singleflight import freeze, shared_single_flight, SingleFlight
+
+
+class FreezeTest(unittest.TestCase):
+
+    def test_lists_and_tuples_are_the_same_key(self):
+        self.assertEqual(freeze({'a': [1]}), freeze({'a': (1,)}))
+
+    def test_dict_order_does_not_matter(self):
+        self.assertEqual(freeze({'a': 1, 'b': {'c': [2, 3]}}), freeze({'b': {'c': [2, 3]}, 'a': 1}))
+
+    def test_sets_are_hashable(self):
+        self.assertEqual(hash(freeze({'facet': set(['x', 'y'])})), hash(freeze({'facet': set(['y', 'x'])})))
+
+    def test_list_order_matters(self):
+        self.assertNotEqual(freeze([1, 2]), freeze([2, 1]))
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def run_concurrently(self, flight, fn, count, key='k'):
+        """ call flight.do(key, fn) from count threads, returning (threads, results, errors) """
+        results, errors = [], []
+
+        def call():
+            try:
+                results.append(flight.do(key, fn))
+            except Exception, e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for t in threads:
+            t.start()
+        return threads, results, errors
+
+    def blocking_fn(self, release, calls, outcome=lambda: 'result'):
+        def fn():
+            calls.append(1)
+            release.wait(5)
+            return outcome()
+        return fn
+
+    def test_concurrent_calls_share_one_result(self):
+        flight = SingleFlight(timeout=5)
+        release, calls = threading.Event(), []
+        threads, results, errors = self.run_concurrently(flight, self.blocking_fn(release, calls), 20)
+        time.sleep(0.1)
+        release.set()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['result'] * 20)
+        self.assertEqual(errors, [])
+        self.assertEqual(flight.stats, {'leaders': 1, 'coalesced': 19, 'timeouts': 0})
+        self.assertEqual(flight.flights, {})
+
+    def test_exception_reaches_every_waiter(self):
+        flight = SingleFlight(timeout=5)
+        release, calls = threading.Event(), []
+
+        def boom():
+            raise ValueError('boom')
+
+        threads, results, errors = self.run_concurrently(flight, self.blocking_fn(release, calls, boom), 20)
+        time.sleep(0.1)
+        release.set()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [])
+        self.assertEqual(len(errors), 20)
+        self.assertTrue(all(isinstance(e, ValueError) for e in errors))
+        self.assertEqual(flight.flights, {})
+
+    def test_distinct_keys_are_not_coalesced(self):
+        flight = SingleFlight()
+        self.assertEqual(flight.do('a', lambda: 1), 1)
+        self.assertEqual(flight.do('b', lambda: 2), 2)
+        self.assertEqual(flight.stats, {'leaders': 2, 'coalesced': 0, 'timeouts': 0})
+
+    def test_timed_out_waiter_replaces_stalled_flight(self):
+        flight = SingleFlight(timeout=0.05)
+        stalled = threading.Event()
+        leader = threading.Thread(target=flight.do, args=('k', lambda: stalled.wait(5) and 'stale'))
+        leader.start()
+        time.sleep(0.02)
+        stale_flight = flight.flights['k']
+
+        self.assertEqual(flight.do('k', lambda: 'fresh'), 'fresh')
+        self.assertEqual(flight.stats['timeouts'], 1)
+        self.assertEqual(flight.stats['leaders'], 2)
+
+        # the stalled leader finishing must not clear a flight it no longer owns
+        replacement = flight.flights['k'] = object()
+        stalled.set()
+        leader.join()
+        self.assertTrue(flight.flights['k'] is replacement)
+        self.assertTrue(stale_flight.done.is_set())
+
+    def test_callers_after_timeout_do_not_wait_on_stalled_flight(self):
+        flight = SingleFlight(timeout=0.2)
+        stalled, fresh = threading.Event(), threading.Event()
+        leader = threading.Thread(target=flight.do, args=('k', lambda: stalled.wait(5)))
+        leader.start()
+        time.sleep(0.02)
+
+        # this waiter times out and leads a new flight that blocks until `fresh` is set
+        taker = threading.Thread(target=flight.do, args=('k', lambda: fresh.wait(5) and 'fresh'))
+        taker.start()
+        time.sleep(0.3)
+        self.assertEqual(flight.stats['timeouts'], 1)
+
+        # a later caller joins the new flight and finishes as soon as it does
+        threads, results, errors = self.run_concurrently(flight, lambda: 'unused', 1)
+        time.sleep(0.02)
+        t0 = time.time()
+        fresh.set()
+        threads[0].join()
+        self.assertTrue(time.time() - t0 < 0.15)
+        self.assertEqual(results, ['fresh'])
+        self.assertEqual(flight.stats['timeouts'], 1)
+
+        stalled.set()
+        leader.join()
+        taker.join()
+
+    def test_waiters_on_a_hung_flight_wait_at_most_timeout(self):
+        flight = SingleFlight(timeout=0.2)
+        stalled = threading.Event()
+        leader = threading.Thread(target=flight.do, args=('k', lambda: stalled.wait(5)))
+        leader.start()
+        time.sleep(0.02)
+
+        # the backend is degraded rather than hung for the callers that follow
+        def slow():
+            time.sleep(0.3)
+            return 'slow'
+
+        waits, results = [], []
+
+        def call():
+            t0 = time.time()
+            results.append(flight.do('k', slow))
+            waits.append(time.time() - t0)
+
+        threads = [threading.Thread(target=call) for _ in range(10)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        # at most timeout waiting plus one slow call, never a chain of timeouts
+        self.assertEqual(results, ['slow'] * 10)
+        self.assertTrue(max(waits) < 0.7, waits)
+        self.assertEqual(flight.stats['timeouts'], 10)
+        self.assertEqual(flight.stats['coalesced'], 0)
+
+        stalled.set()
+        leader.join()
+
+
+class SharedSingleFlightTest(unittest.TestCase):
+
+    def test_same_name_and_timeout_share_an_instance(self):
+        self.assertTrue(shared_single_flight('shared-test', 1) is shared_single_flight('shared-test', 1))
+        self.assertFalse(shared_single_flight('shared-test', 1) is shared_single_flight('shared-test', 2))
+        self.assertFalse(shared_single_flight('shared-test', 1) is shared_single_flight('other-test', 1))
+
+
+if __name__ == '__main__':
+    unittest.main()